@@ -1,12 +1,15 @@
 """
 VoiceChangerV2
 """
+import os
 from dataclasses import asdict
 from typing import cast
 
+import faiss
 import numpy as np
-import resampy
 import torch
+import torchaudio
+from numba import njit
 
 from mods.log_control import VoiceChangaerLogger
 from RVC.deviceManager.DeviceManager import DeviceManager
@@ -33,9 +36,73 @@ from utils.VoiceChangerParams import VoiceChangerParams
 logger = VoiceChangaerLogger.get_instance().getLogger()
 
 
+_threadsConfigured = False
+
+
+def _configureThreads():
+    # faiss (OpenMP) and torch each start their own worker pools. Limit them once so they do not oversubscribe the cores on cpu.
+    global _threadsConfigured
+    if _threadsConfigured:
+        return
+    _threadsConfigured = True
+
+    faiss.omp_set_num_threads(2)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // 2))
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError as e:
+        # Can only be set before any inter-op parallel work has started.
+        logger.warn(f"[Voice Changer] [RVCr2] inter-op threads are not changed. {e}")
+
+
+def _shiftBuffer(buffer: np.ndarray, length: int):
+    # Shift the buffer to the front along its last (time) axis in place.
+    # Shifting the flattened view is a single memmove. For 2D (channel, time) buffers the head of each channel
+    # moves into the tail of the previous one, which is overwritten with the new data afterwards.
+    if length == 0:
+        return
+    flat = buffer.reshape(-1)
+    flat[:-length] = flat[length:]
+
+
+def _convertSize(inputSize: int, crossfadeSize: int, solaSearchFrame: int, extra_frame: int):
+    convertSize = inputSize + crossfadeSize + solaSearchFrame + extra_frame
+    # Round up to the hop size to compensate for truncation that occurs in the hop size of the model output.
+    return ((convertSize + 159) // 160) * 160
+
+
+def _pushBack(buffer: np.ndarray, data, length: int):
+    # Shift the buffer and write the new data at the tail.
+    if length == 0:
+        return
+    _shiftBuffer(buffer, length)
+    buffer[..., -length:] = data
+
+
+@njit(cache=True, fastmath=True)
+def _normalizeAndRms(newData, buffer, crop_start, crop_end):
+    # Write newData / 32768 into the tail of buffer and return the RMS of buffer[crop_start:crop_end] in one pass.
+    inv = 1.0 / 32768.0
+    offset = buffer.shape[0] - newData.shape[0]
+    sumsq = 0.0
+    for i in range(crop_start, min(crop_end, offset)):
+        v = buffer[i]
+        sumsq += v * v
+    for i in range(newData.shape[0]):
+        v = newData[i] * inv
+        buffer[offset + i] = v
+        if crop_start <= offset + i < crop_end:
+            sumsq += v * v
+    n = crop_end - crop_start
+    if n <= 0:
+        return 0.0
+    return np.sqrt(sumsq / n)
+
+
 class RVCr2(VoiceChangerModel):
     def __init__(self, params: VoiceChangerParams, slotInfo: RVCModelSlot):
         logger.info("[Voice Changer] [RVCr2] Creating instance ")
+        _configureThreads()
         self.deviceManager = DeviceManager.get_instance()
         EmbedderManager.initialize(params)
         PitchExtractorManager.initialize(params)
@@ -48,8 +115,19 @@ class RVCr2(VoiceChangerModel):
         self.audio_buffer: AudioInOut | None = None
         self.pitchf_buffer: PitchfInOut | None = None
         self.feature_buffer: FeatureInOut | None = None
+        self.audio_buffer_host: torch.Tensor | None = None
+        self.audio_buffer_dev: torch.Tensor | None = None
+        self.copy_stream: torch.cuda.Stream | None = None
+        self.pitch_stream: torch.cuda.Stream | None = None
+        self.embed_stream: torch.cuda.Stream | None = None
+        self.silent_out: AudioInOut | None = None
+        # 16k sizes of the last chunk (input, crossfade, sola search) and the (convertSize, repeat) the embedder was run for.
+        self.chunkSizes: tuple[int, int, int] | None = None
+        self.warmedUpSize: tuple[int, int] | None = None
         self.prevVol = 0.0
         self.slotInfo = slotInfo
+        self.in_resampler: torchaudio.transforms.Resample | None = None
+        self.out_resampler: torchaudio.transforms.Resample | None = None
         # self.initialize()
 
     def initialize(self):
@@ -70,6 +148,21 @@ class RVCr2(VoiceChangerModel):
             )
             return
 
+        # Host-to-device copies of the input audio, pitch extraction and embedding are issued on dedicated streams.
+        if self.pipeline.device.type == "cuda":
+            self.copy_stream = torch.cuda.Stream(device=self.pipeline.device)
+            self.pitch_stream = torch.cuda.Stream(device=self.pipeline.device)
+            self.embed_stream = torch.cuda.Stream(device=self.pipeline.device)
+        else:
+            self.copy_stream = None
+            self.pitch_stream = None
+            self.embed_stream = None
+        self.audio_buffer_dev = None
+
+        # A new pipeline has a new embedder, compile it for the current sizes before the next chunk.
+        self.warmedUpSize = None
+        self._warmupEmbedder()
+
         # Other settings
         self.settings.tran = self.slotInfo.defaultTune
         self.settings.indexRatio = self.slotInfo.defaultIndexRatio
@@ -79,8 +172,37 @@ class RVCr2(VoiceChangerModel):
     def setSamplingRate(self, inputSampleRate, outputSampleRate):
         self.inputSampleRate = inputSampleRate
         self.outputSampleRate = outputSampleRate
+        # Conversion factors from input frames to processing (16k) frames and to seconds.
+        self.inputTo16k = 16000 / inputSampleRate
+        self.inputFrameSeconds = 1 / inputSampleRate
+        # Resampling kernels are computed once per sampling rate pair and reused for every chunk.
+        self.in_resampler = self._createResampler(
+            self.in_resampler, inputSampleRate, 16000
+        )
+        self.out_resampler = self._createResampler(
+            self.out_resampler, self.slotInfo.samplingRate, outputSampleRate
+        )
         # self.initialize()
 
+    def _createResampler(
+        self,
+        resampler: torchaudio.transforms.Resample | None,
+        orig_freq: int,
+        new_freq: int,
+    ):
+        if (
+            resampler is not None
+            and resampler.orig_freq == orig_freq
+            and resampler.new_freq == new_freq
+        ):
+            return resampler
+        return torchaudio.transforms.Resample(
+            orig_freq,
+            new_freq,
+            lowpass_filter_width=16,
+            resampling_method="sinc_interp_kaiser",
+        )
+
     def update_settings(self, key: str, val: int | float | str):
         logger.info(f"[Voice Changer][RVC]: update_settings {key}:{val}")
         if key in self.settings.intData:
@@ -88,6 +210,8 @@ class RVCr2(VoiceChangerModel):
             if key == "gpu":
                 self.deviceManager.setForceTensor(False)
                 self.initialize()
+            elif key in ("extraConvertSize", "rvcQuality"):
+                self._warmupEmbedder()
         elif key in self.settings.floatData:
             setattr(self.settings, key, float(val))
         elif key in self.settings.strData:
@@ -113,6 +237,88 @@ class RVCr2(VoiceChangerModel):
     def get_processing_sampling_rate(self):
         return self.slotInfo.samplingRate
 
+    def _reserveBuffers(self, convertSize: int):
+        # The buffers are only reallocated when a larger convert size is requested.
+        if (
+            self.audio_buffer is not None
+            and self.audio_buffer.shape[0] >= convertSize
+        ):
+            return
+
+        featureSize = convertSize // 160
+        # The audio buffer is backed by page-locked memory when running on cuda,
+        # so it can be copied to the device asynchronously.
+        pin_memory = (
+            self.pipeline is not None and self.pipeline.device.type == "cuda"
+        )
+        audio_buffer_host = torch.zeros(
+            convertSize, dtype=torch.float32, pin_memory=pin_memory
+        )
+        audio_buffer = audio_buffer_host.numpy()
+        pitchf_buffer = (
+            np.zeros(featureSize, dtype=np.float32)
+            if self.slotInfo.f0
+            else None
+        )
+        # Features are stored channel-major (embChannels, time) so that each channel is contiguous.
+        feature_buffer = np.zeros(
+            (self.slotInfo.embChannels, featureSize), dtype=np.float32
+        )
+
+        # Keep the past data when growing
+        if self.audio_buffer is not None:
+            audio_buffer[-self.audio_buffer.shape[0]:] = self.audio_buffer
+            if pitchf_buffer is not None and self.pitchf_buffer is not None:
+                pitchf_buffer[-self.pitchf_buffer.shape[0]:] = self.pitchf_buffer
+            feature_buffer[:, -self.feature_buffer.shape[1]:] = self.feature_buffer
+
+        self.silent_out = np.zeros(convertSize, dtype=np.int16)
+        self.audio_buffer_host = audio_buffer_host
+        self.audio_buffer = audio_buffer
+        self.pitchf_buffer = pitchf_buffer
+        self.feature_buffer = feature_buffer
+
+    def _copyAudioToDevice(self, convertSize: int, device: torch.device):
+        # The device tensor is allocated once and reused; it is only rebuilt when the buffer grows or the device changes.
+        if (
+            self.audio_buffer_dev is None
+            or self.audio_buffer_dev.shape != self.audio_buffer_host.shape
+            or self.audio_buffer_dev.device != device
+        ):
+            self.audio_buffer_dev = torch.zeros_like(
+                self.audio_buffer_host, device=device
+            )
+
+        audio_dev = self.audio_buffer_dev[-convertSize:]
+        audio_host = self.audio_buffer_host[-convertSize:]
+        if self.copy_stream is None:
+            audio_dev.copy_(audio_host, non_blocking=True)
+            return audio_dev
+
+        current_stream = torch.cuda.current_stream(device)
+        self.copy_stream.wait_stream(current_stream)
+        with torch.cuda.stream(self.copy_stream):
+            audio_dev.copy_(audio_host, non_blocking=True)
+        current_stream.wait_stream(self.copy_stream)
+        return audio_dev
+
+    def _warmupEmbedder(self):
+        # The chunk size is only known from the chunks themselves, so the last chunk is combined with the current settings.
+        if self.pipeline is None or self.chunkSizes is None:
+            return
+        extra_frame = int(self.settings.extraConvertSize * self.inputTo16k)
+        convertSize = _convertSize(*self.chunkSizes, extra_frame)
+        repeat = 1 if self.settings.rvcQuality else 0
+        if self.warmedUpSize == (convertSize, repeat):
+            return
+        self.pipeline.warmupEmbedder(
+            convertSize,
+            repeat,
+            self.slotInfo.embOutputLayer,
+            self.slotInfo.useFinalProj,
+        )
+        self.warmedUpSize = (convertSize, repeat)
+
     def generate_input(
         self,
         newData: AudioInOut,
@@ -122,79 +328,44 @@ class RVCr2(VoiceChangerModel):
     ):
         # It comes in at 16k.
         inputSize = newData.shape[0]
-        newData = newData.astype(np.float32) / 32768.0
         newFeatureLength = inputSize // 160  # hopsize:=160
 
-        if self.audio_buffer is not None:
-            # Link to past data
-            self.audio_buffer = np.concatenate([self.audio_buffer, newData], 0)
-            if self.slotInfo.f0:
-                self.pitchf_buffer = np.concatenate(
-                    [self.pitchf_buffer, np.zeros(newFeatureLength)], 0
-                )
-            self.feature_buffer = np.concatenate(
-                [
-                    self.feature_buffer,
-                    np.zeros([newFeatureLength, self.slotInfo.embChannels]),
-                ],
-                0,
-            )
-        else:
-            self.audio_buffer = newData
-            if self.slotInfo.f0:
-                self.pitchf_buffer = np.zeros(newFeatureLength)
-            self.feature_buffer = np.zeros(
-                [newFeatureLength, self.slotInfo.embChannels]
-            )
-
-        convertSize = inputSize + crossfadeSize + solaSearchFrame + extra_frame
-
-        if (
-            convertSize % 160 != 0
-        ):  # Compensate for truncation that occurs in the hop size of the model output.
-            convertSize = convertSize + (160 - (convertSize % 160))
+        convertSize = _convertSize(inputSize, crossfadeSize, solaSearchFrame, extra_frame)
         outSize = int(
             ((convertSize - extra_frame) / 16000) * self.slotInfo.samplingRate
         )
+        featureSize = convertSize // 160
 
-        # If the buffer is not full, fill it with zero
-        if self.audio_buffer.shape[0] < convertSize:
-            self.audio_buffer = np.concatenate(
-                [np.zeros([convertSize]), self.audio_buffer]
-            )
-            if self.slotInfo.f0:
-                self.pitchf_buffer = np.concatenate(
-                    [np.zeros([convertSize // 160]), self.pitchf_buffer]
-                )
-            self.feature_buffer = np.concatenate(
-                [
-                    np.zeros([convertSize // 160, self.slotInfo.embChannels]),
-                    self.feature_buffer,
-                ]
-            )
+        # Link to past data. The buffers start out as zeros, so they are always full.
+        self._reserveBuffers(convertSize)
+        _shiftBuffer(self.audio_buffer, inputSize)
 
-        # Trim unnecessary parts
-        convertOffset = -1 * convertSize
-        featureOffset = convertOffset // 160
-        self.audio_buffer = self.audio_buffer[
-            convertOffset:
-        ]  # Extract only the part to be converted
-        if self.slotInfo.f0:
-            self.pitchf_buffer = self.pitchf_buffer[featureOffset:]
-        self.feature_buffer = self.feature_buffer[featureOffset:]
-
-        # Cut out only the output part and check the volume.(TODO:mute in stages)
-        cropOffset = -1 * (inputSize + crossfadeSize)
-        cropEnd = -1 * (crossfadeSize)
-        crop = self.audio_buffer[cropOffset:cropEnd]
-        vol = np.sqrt(np.square(crop).mean())
+        # Normalize the new data into the buffer tail and check the volume of the output part.(TODO:mute in stages)
+        bufferSize = self.audio_buffer.shape[0]
+        vol = _normalizeAndRms(
+            newData,
+            self.audio_buffer,
+            bufferSize - (inputSize + crossfadeSize),
+            bufferSize - crossfadeSize,
+        )
         vol = max(vol, self.prevVol * 0.0)
         self.prevVol = vol
 
+        if self.slotInfo.f0:
+            _pushBack(self.pitchf_buffer, 0.0, newFeatureLength)
+        _pushBack(self.feature_buffer, 0.0, newFeatureLength)
+
+        # Extract only the part to be converted
+        audio = self.audio_buffer[-convertSize:]
+        pitchf = (
+            self.pitchf_buffer[-featureSize:] if self.slotInfo.f0 else None
+        )
+        feature = self.feature_buffer[:, -featureSize:].T  # (time, embChannels) view
+
         return (
-            self.audio_buffer,
-            self.pitchf_buffer,
-            self.feature_buffer,
+            audio,
+            pitchf,
+            feature,
             convertSize,
             vol,
             outSize,
@@ -211,26 +382,19 @@ class RVCr2(VoiceChangerModel):
             raise PipelineNotInitializedException()
 
         # Processing is done at 16K (Pitch, embed, (infer))
-        receivedData = cast(
-            AudioInOut,
-            resampy.resample(
-                receivedData,
-                self.inputSampleRate,
-                16000,
-            ),
-        )
-        crossfade_frame = int((crossfade_frame / self.inputSampleRate) * 16000)
-        sola_search_frame = int(
-            (sola_search_frame / self.inputSampleRate) * 16000
-        )
-        extra_frame = int(
-            (self.settings.extraConvertSize / self.inputSampleRate) * 16000
-        )
+        # When the input is already at 16k it goes to generate_input as is, the normalization kernel accepts int16 as well.
+        if self.inputSampleRate != 16000:
+            audio_t = torch.from_numpy(receivedData).to(dtype=torch.float32)
+            receivedData = cast(AudioInOut, self.in_resampler(audio_t).numpy())
+        crossfade_frame = int(crossfade_frame * self.inputTo16k)
+        sola_search_frame = int(sola_search_frame * self.inputTo16k)
+        extra_frame = int(self.settings.extraConvertSize * self.inputTo16k)
 
         # Generate input data
         data = self.generate_input(
             receivedData, crossfade_frame, sola_search_frame, extra_frame
         )
+        self.chunkSizes = (receivedData.shape[0], crossfade_frame, sola_search_frame)
 
         audio = data[0]
         pitchf = data[1]
@@ -240,11 +404,15 @@ class RVCr2(VoiceChangerModel):
         outSize = data[5]
 
         if vol < self.settings.silentThreshold:
-            return np.zeros(convertSize).astype(np.int16) * np.sqrt(vol)
+            return self.silent_out[:convertSize]
 
         device = self.pipeline.device
 
-        audio = torch.from_numpy(audio).to(device=device, dtype=torch.float32)
+        if device.type == "cpu":
+            # Shares memory with the audio buffer, no copy is needed.
+            audio = torch.from_numpy(audio)
+        else:
+            audio = self._copyAudioToDevice(convertSize, device)
         repeat = 1 if self.settings.rvcQuality else 0
         sid = self.settings.dstId
         f0_up_key = self.settings.tran
@@ -254,12 +422,14 @@ class RVCr2(VoiceChangerModel):
         if_f0 = 1 if self.slotInfo.f0 else 0
         embOutputLayer = self.slotInfo.embOutputLayer
         useFinalProj = self.slotInfo.useFinalProj
+        # The embedder call below compiles this size itself if it has not been warmed up.
+        self.warmedUpSize = (convertSize, repeat)
 
         try:
             (
                 audio_out,
-                self.pitchf_buffer,
-                self.feature_buffer,
+                pitchf_out,
+                feature_out,
             ) = self.pipeline.exec(
                 sid,
                 audio,
@@ -269,7 +439,7 @@ class RVCr2(VoiceChangerModel):
                 index_rate,
                 if_f0,
                 # 0,
-                self.settings.extraConvertSize / self.inputSampleRate
+                self.settings.extraConvertSize * self.inputFrameSeconds
                 if self.settings.silenceFront
                 else 0.0,  # extaraDataSize in seconds. Calculated based on input sampling rate
                 embOutputLayer,
@@ -277,18 +447,29 @@ class RVCr2(VoiceChangerModel):
                 repeat,
                 protect,
                 outSize,
+                pitch_stream=self.pitch_stream,
+                embed_stream=self.embed_stream,
             )
+            # Store the estimated pitch and features at the tail of the buffers for the next chunk.
+            if pitchf_out is not None:
+                pitchf_out = pitchf_out[-self.pitchf_buffer.shape[0]:]
+                self.pitchf_buffer[-pitchf_out.shape[0]:] = pitchf_out.numpy()
+            feature_out = feature_out[-self.feature_buffer.shape[1]:]
+            self.feature_buffer[:, -feature_out.shape[0]:] = feature_out.numpy().T
+
             # result = audio_out.detach().cpu().numpy() * np.sqrt(vol)
-            result = audio_out[-outSize:].detach().cpu().numpy() * np.sqrt(vol)
-
-            result = cast(
-                AudioInOut,
-                resampy.resample(
-                    result,
-                    self.slotInfo.samplingRate,
-                    self.outputSampleRate,
-                ),
+            # Scale and resample on the device the model output lives on.
+            # The onnx inferencer already returns a cpu tensor, so the transfer below is a no-op for it.
+            result = (
+                audio_out[-outSize:]
+                .detach()
+                .to(dtype=torch.float32)
+                .mul_(np.sqrt(vol))
             )
+            if self.slotInfo.samplingRate != self.outputSampleRate:
+                self.out_resampler = self.out_resampler.to(audio_out.device)
+                result = self.out_resampler(result)
+            result = cast(AudioInOut, result.cpu().numpy())
 
             return result
         except DeviceCannotSupportHalfPrecisionException as e:  # NOQA
@@ -297,9 +478,8 @@ class RVCr2(VoiceChangerModel):
             )
             self.deviceManager.setForceTensor(True)
             self.initialize()
-            # raise e
-
-        return
+            # The caller returns dummy data for this chunk.
+            raise e
 
     def __del__(self):
         del self.pipeline
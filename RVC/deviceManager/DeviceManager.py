@@ -89,6 +89,17 @@ class DeviceManager(object):
 
         return True
 
+    def halfPrecisionDtype(self, id: int):
+        # bfloat16 has the dynamic range of float32, so it is preferred on devices that support it natively (Ampere or later).
+        try:
+            cap = torch.cuda.get_device_capability(id)
+        except Exception as e:
+            print(e)
+            return torch.float16
+        if cap[0] >= 8:
+            return torch.bfloat16
+        return torch.float16
+
     def getDeviceMemory(self, id: int):
         try:
             return torch.cuda.get_device_properties(id).total_memory
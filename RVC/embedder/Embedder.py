@@ -15,7 +15,7 @@ class Embedder(EmbedderProtocol):
 
         self.model: Any | None = None
 
-    def loadModel(self, file: str, dev: device, isHalf: bool = True):
+    def loadModel(self, file: str, dev: device, isHalf: bool = True, halfDtype: torch.dtype = torch.float16):
         ...
 
     def extractFeatures(
@@ -38,16 +38,18 @@ class Embedder(EmbedderProtocol):
         file: str,
         dev: device,
         isHalf: bool = True,
+        halfDtype: torch.dtype = torch.float16,
     ):
         self.embedderType = embedderType
         self.file = file
         self.isHalf = isHalf
+        self.halfDtype = halfDtype
         self.dev = dev
 
     def setHalf(self, isHalf: bool):
         self.isHalf = isHalf
         if self.model is not None and isHalf:
-            self.model = self.model.half()
+            self.model = self.model.to(self.halfDtype)
         elif self.model is not None and isHalf is False:
             self.model = self.model.float()
 
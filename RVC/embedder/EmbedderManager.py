@@ -1,3 +1,4 @@
+import torch
 from torch import device
 
 from utils.const import EmbedderType
@@ -19,17 +20,17 @@ class EmbedderManager:
 
     @classmethod
     def getEmbedder(
-        cls, embederType: EmbedderType, isHalf: bool, dev: device
+        cls, embederType: EmbedderType, isHalf: bool, dev: device, halfDtype: torch.dtype = torch.float16
     ) -> Embedder:
         if cls.currentEmbedder is None:
             print("[Voice Changer] generate new embedder. (no embedder)")
-            cls.currentEmbedder = cls.loadEmbedder(embederType, isHalf, dev)
+            cls.currentEmbedder = cls.loadEmbedder(embederType, isHalf, dev, halfDtype)
         elif cls.currentEmbedder.matchCondition(embederType) is False:
             print("[Voice Changer] generate new embedder. (not match)")
-            cls.currentEmbedder = cls.loadEmbedder(embederType, isHalf, dev)
+            cls.currentEmbedder = cls.loadEmbedder(embederType, isHalf, dev, halfDtype)
         else:
             print("[Voice Changer] generate new embedder. (anyway)")
-            cls.currentEmbedder = cls.loadEmbedder(embederType, isHalf, dev)
+            cls.currentEmbedder = cls.loadEmbedder(embederType, isHalf, dev, halfDtype)
 
             # cls.currentEmbedder.setDevice(dev)
             # cls.currentEmbedder.setHalf(isHalf)
@@ -37,7 +38,7 @@ class EmbedderManager:
 
     @classmethod
     def loadEmbedder(
-        cls, embederType: EmbedderType, isHalf: bool, dev: device
+        cls, embederType: EmbedderType, isHalf: bool, dev: device, halfDtype: torch.dtype = torch.float16
     ) -> Embedder:
         if embederType == "hubert_base":
             try:
@@ -48,10 +49,10 @@ class EmbedderManager:
             except Exception as e:  # noqa
                 print("[Voice Changer] use torch contentvec", e)
                 file = cls.params.hubert_base
-                return FairseqHubert().loadModel(file, dev, isHalf)
+                return FairseqHubert().loadModel(file, dev, isHalf, halfDtype)
         elif embederType == "hubert-base-japanese":
             file = cls.params.hubert_base_jp
-            return FairseqHubertJp().loadModel(file, dev, isHalf)
+            return FairseqHubertJp().loadModel(file, dev, isHalf, halfDtype)
         elif embederType == "contentvec":
             try:
                 if cls.params.content_vec_500_onnx_on is False:
@@ -61,6 +62,6 @@ class EmbedderManager:
             except Exception as e:
                 print(e)
                 file = cls.params.hubert_base
-                return FairseqContentvec().loadModel(file, dev, isHalf)
+                return FairseqContentvec().loadModel(file, dev, isHalf, halfDtype)
         else:
-            return FairseqHubert().loadModel(file, dev, isHalf)
+            return FairseqHubert().loadModel(file, dev, isHalf, halfDtype)
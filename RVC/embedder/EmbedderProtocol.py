@@ -6,7 +6,7 @@ from torch import device
 
 class EmbedderProtocol(Protocol):
 
-    def loadModel(self, file: str, dev: device, isHalf: bool = True):
+    def loadModel(self, file: str, dev: device, isHalf: bool = True, halfDtype: torch.dtype = torch.float16):
         ...
 
     def extractFeatures(
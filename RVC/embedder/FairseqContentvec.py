@@ -1,10 +1,11 @@
+import torch
 from torch import device
 from RVC.embedder.Embedder import Embedder
 from RVC.embedder.FairseqHubert import FairseqHubert
 
 
 class FairseqContentvec(FairseqHubert):
-    def loadModel(self, file: str, dev: device, isHalf: bool = True) -> Embedder:
-        super().loadModel(file, dev, isHalf)
-        super().setProps("contentvec", file, dev, isHalf)
+    def loadModel(self, file: str, dev: device, isHalf: bool = True, halfDtype: torch.dtype = torch.float16) -> Embedder:
+        super().loadModel(file, dev, isHalf, halfDtype)
+        super().setProps("contentvec", file, dev, isHalf, halfDtype)
         return self
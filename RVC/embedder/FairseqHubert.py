@@ -5,8 +5,8 @@ from fairseq import checkpoint_utils
 
 
 class FairseqHubert(Embedder):
-    def loadModel(self, file: str, dev: device, isHalf: bool = True) -> Embedder:
-        super().setProps("hubert_base", file, dev, isHalf)
+    def loadModel(self, file: str, dev: device, isHalf: bool = True, halfDtype: torch.dtype = torch.float16) -> Embedder:
+        super().setProps("hubert_base", file, dev, isHalf, halfDtype)
 
         models, saved_cfg, task = checkpoint_utils.load_model_ensemble_and_task(
             [file],
@@ -16,8 +16,9 @@ class FairseqHubert(Embedder):
         model.eval()
 
         model = model.to(dev)
+        # Weights are stored in the same dtype autocast computes in, so they are not cast on every chunk.
         if isHalf:
-            model = model.half()
+            model = model.to(halfDtype)
 
         self.model = model
         return self
@@ -25,7 +26,8 @@ class FairseqHubert(Embedder):
     def extractFeatures(
         self, feats: torch.Tensor, embOutputLayer=9, useFinalProj=True
     ) -> torch.Tensor:
-        padding_mask = torch.BoolTensor(feats.shape).to(self.dev).fill_(False)
+        # Created on the device directly. This avoids a host-to-device copy and keeps the call capturable into a CUDA graph.
+        padding_mask = torch.zeros(feats.shape, dtype=torch.bool, device=self.dev)
 
         # In the original_v1, final_proj was applied to L9.(-> 256)
         # The original_v2 does not apply final_proj to L12.(-> 768)
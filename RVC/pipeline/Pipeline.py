@@ -1,4 +1,5 @@
 import numpy as np
+from contextlib import nullcontext
 from typing import Any
 import math
 import torch
@@ -23,18 +24,30 @@ from utils.Timer import Timer2
 logger = VoiceChangaerLogger.get_instance().getLogger()
 
 
+# Number of chunks with the same input shape before the embedder is captured into a CUDA graph.
+CUDA_GRAPH_WARMUP = 3
+# Number of captured embedder graphs kept at once. Each graph holds its own memory pool.
+CUDA_GRAPH_CACHE_SIZE = 4
+
+
+def _streamContext(stream: torch.cuda.Stream | None):
+    return torch.cuda.stream(stream) if stream is not None else nullcontext()
+
+
 class Pipeline(object):
     embedder: Embedder
     inferencer: Inferencer
     pitchExtractor: PitchExtractor
 
     index: Any | None
+    indexResources: Any | None
     big_npy: Any | None
     # feature: Any | None
 
     targetSR: int
     device: torch.device
     isHalf: bool
+    halfDtype: torch.dtype
 
     def __init__(
         self,
@@ -46,6 +59,8 @@ class Pipeline(object):
         targetSR,
         device,
         isHalf,
+        halfDtype=None,
+        compiledEmbedder=False,
     ):
         self.embedder = embedder
         self.inferencer = inferencer
@@ -55,25 +70,39 @@ class Pipeline(object):
         logger.info("GENERATE PITCH EXTRACTOR" + str(self.pitchExtractor))
 
         self.index = index
+        self.indexResources = None
         self.big_npy = index.reconstruct_n(0, index.ntotal) if index is not None else None
         # self.feature = feature
 
         self.targetSR = targetSR
         self.device = device
         self.isHalf = isHalf
+        self.halfDtype = halfDtype if halfDtype is not None else torch.float16
 
         self.sr = 16000
         self.window = 160
 
+        # Replay the embedder from CUDA graphs once the input shape is stable.
+        self.useCudaGraph = device.type == "cuda" and isinstance(getattr(embedder, "model", None), torch.nn.Module)
+        self.embedderGraphs: dict[tuple, tuple[torch.cuda.CUDAGraph, torch.Tensor, torch.Tensor]] = {}
+        self.embedderGraphWarmup: dict[tuple, int] = {}
+        # The embedder is wrapped by torch.compile and specialized for each input shape.
+        self.compiledEmbedder = compiledEmbedder
+
     def getPipelineInfo(self):
         inferencerInfo = self.inferencer.getInferencerInfo() if self.inferencer else {}
         embedderInfo = self.embedder.getEmbedderInfo()
         pitchExtractorInfo = self.pitchExtractor.getPitchExtractorInfo()
-        return {"inferencer": inferencerInfo, "embedder": embedderInfo, "pitchExtractor": pitchExtractorInfo, "isHalf": self.isHalf}
+        return {"inferencer": inferencerInfo, "embedder": embedderInfo, "pitchExtractor": pitchExtractorInfo, "isHalf": self.isHalf, "halfDtype": str(self.halfDtype)}
 
     def setPitchExtractor(self, pitchExtractor: PitchExtractor):
         self.pitchExtractor = pitchExtractor
 
+    def setIndex(self, index: Any, indexResources: Any | None = None):
+        # Replaces the index used for searching. big_npy is kept as it is.
+        self.index = index
+        self.indexResources = indexResources
+
     def extractPitch(self, audio_pad, if_f0, pitchf, f0_up_key, silence_front):
         try:
             if if_f0 == 1:
@@ -99,12 +128,33 @@ class Pipeline(object):
             raise NotEnoughDataExtimateF0()
         return pitch, pitchf
 
+    def qualityPadding(self, audioSize: int, repeat: int):
+        quality_padding_sec = (repeat * (audioSize - 1)) / self.sr  # padding(reflect) The size of the file must be smaller than the original size.
+
+        t_pad = round(self.sr * quality_padding_sec)  # Add audio before and after
+        t_pad_tgt = round(self.targetSR * quality_padding_sec)  # Add audio before and after; trimming when outputting (outputted by sampling the model)
+        return t_pad, t_pad_tgt
+
+    def warmupEmbedder(self, convertSize: int, repeat: int, embOutputLayer, useFinalProj):
+        # Runs the compile for the embedder input of exec ahead of the first chunk of that size.
+        if self.compiledEmbedder is False:
+            return
+        t_pad, _ = self.qualityPadding(convertSize, repeat)
+        dtype = self.halfDtype if self.isHalf else torch.float32
+        feats = torch.zeros(1, convertSize + t_pad * 2, dtype=dtype, device=self.device)
+        try:
+            self.extractFeatures(feats, embOutputLayer, useFinalProj)
+        except Exception as e:
+            logger.warn(f"[Voice Changer] embedder warm up failed. {e}")
+
     def extractFeatures(self, feats, embOutputLayer, useFinalProj):
-        with autocast(enabled=self.isHalf):
+        # The autocast weight cache cannot be used while capturing CUDA graphs.
+        with autocast(enabled=self.isHalf, dtype=self.halfDtype, cache_enabled=self.useCudaGraph is False):
             try:
-                feats = self.embedder.extractFeatures(feats, embOutputLayer, useFinalProj)
-                if torch.isnan(feats).all():
-                    raise DeviceCannotSupportHalfPrecisionException()
+                if self.useCudaGraph:
+                    feats = self.extractFeaturesWithGraph(feats, embOutputLayer, useFinalProj)
+                else:
+                    feats = self.embedder.extractFeatures(feats, embOutputLayer, useFinalProj)
                 return feats
             except RuntimeError as e:
                 if "HALF" in e.__str__().upper():
@@ -113,11 +163,55 @@ class Pipeline(object):
                     raise DeviceChangingException()
                 else:
                     raise e
-                
+
+    def extractFeaturesWithGraph(self, feats, embOutputLayer, useFinalProj):
+        key = (tuple(feats.shape), feats.dtype, embOutputLayer, useFinalProj)
+        entry = self.embedderGraphs.get(key)
+        if entry is None:
+            # Run eagerly until the same shape has been seen a few times, which also warms up the kernels.
+            seen = self.embedderGraphWarmup.get(key, 0) + 1
+            self.embedderGraphWarmup[key] = seen
+            if seen < CUDA_GRAPH_WARMUP:
+                return self.embedder.extractFeatures(feats, embOutputLayer, useFinalProj)
+            entry = self.captureEmbedder(key, feats, embOutputLayer, useFinalProj)
+            if entry is None:
+                return self.embedder.extractFeatures(feats, embOutputLayer, useFinalProj)
+
+        graph, staticInput, staticOutput = entry
+        staticInput.copy_(feats)
+        graph.replay()
+        # The output is overwritten by the next replay. It is only read within this chunk.
+        return staticOutput
+
+    def captureEmbedder(self, key, feats, embOutputLayer, useFinalProj):
+        try:
+            staticInput = feats.clone()
+            graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(graph):
+                staticOutput = self.embedder.extractFeatures(staticInput, embOutputLayer, useFinalProj)
+        except RuntimeError as e:
+            logger.warn(f"[Voice Changer] Embedder cannot be captured into a CUDA graph. Fallback to eager execution. {e}")
+            self.useCudaGraph = False
+            self.embedderGraphs.clear()
+            return None
+
+        if len(self.embedderGraphs) >= CUDA_GRAPH_CACHE_SIZE:
+            # Drop the oldest graph
+            del self.embedderGraphs[next(iter(self.embedderGraphs))]
+        entry = (graph, staticInput, staticOutput)
+        self.embedderGraphs[key] = entry
+        logger.info(f"[Voice Changer] Embedder captured into a CUDA graph. input shape:{key[0]}")
+        return entry
+
+    def checkFeatures(self, feats):
+        # Reading the result synchronizes with the device, so this is done after all stages have been issued.
+        if torch.isnan(feats).all():
+            raise DeviceCannotSupportHalfPrecisionException()
+
     def infer(self, feats, p_len, pitch, pitchf, sid, out_size):
         try:
             with torch.no_grad():
-                with autocast(enabled=self.isHalf):
+                with autocast(enabled=self.isHalf, dtype=self.halfDtype):
                     audio1 = self.inferencer.infer(feats,  p_len, pitch, pitchf, sid, out_size)                    
                     audio1 = (audio1 * 32767.5).data.to(dtype=torch.int16)
             return audio1
@@ -143,6 +237,8 @@ class Pipeline(object):
         repeat,
         protect=0.5,
         out_size=None,
+        pitch_stream: torch.cuda.Stream | None = None,
+        embed_stream: torch.cuda.Stream | None = None,
     ):
         # print(f"pipeline exec input, audio:{audio.shape}, pitchf:{pitchf.shape}, feature:{feature.shape}")
         # print(f"pipeline exec input, silence_front:{silence_front}, out_size:{out_size}")
@@ -154,17 +250,14 @@ class Pipeline(object):
             # self.t_pad_tgt = self.targetSR * repeat  # 1 second Trimming at output (output by model sampling)
             audio = audio.unsqueeze(0)
 
-            quality_padding_sec = (repeat * (audio.shape[1] - 1)) / self.sr  # padding(reflect) The size of the file must be smaller than the original size.
-
-            self.t_pad = round(self.sr * quality_padding_sec)  # Add audio before and after
-            self.t_pad_tgt = round(self.targetSR * quality_padding_sec)  # Add audio before and after; trimming when outputting (outputted by sampling the model)
+            self.t_pad, self.t_pad_tgt = self.qualityPadding(audio.shape[1], repeat)
             audio_pad = F.pad(audio, (self.t_pad, self.t_pad), mode="reflect").squeeze(0)
             p_len = audio_pad.shape[0] // self.window
             sid = torch.tensor(sid, device=self.device).unsqueeze(0).long()
 
             # Turn off silence_front when RVC Quality is On.
             silence_front = silence_front if repeat == 0 else 0
-            pitchf = pitchf if repeat == 0 else np.zeros(p_len)
+            pitchf = pitchf if repeat == 0 else np.zeros(p_len, dtype=np.float32)
             out_size = out_size if repeat == 0 else None
 
             # Tensor type adjustment
@@ -173,16 +266,40 @@ class Pipeline(object):
                 feats = feats.mean(-1)
             assert feats.dim() == 1, feats.dim()
             feats = feats.view(1, -1)
+            # The pitch extractors work in float32, only the embedder input is reduced.
+            if self.isHalf:
+                feats = feats.to(dtype=self.halfDtype)
 
             t.record("pre-process")
-            # pitch detection
-            pitch, pitchf = self.extractPitch(audio_pad, if_f0, pitchf, f0_up_key, silence_front)
-            t.record("extract-pitch")
+            # Pitch detection and embedding are independent. When streams are given, both are issued on their own stream.
+            # The embedding is issued first so that its kernels run while the pitch extractor works.
+            if pitch_stream is not None and embed_stream is not None:
+                current_stream = torch.cuda.current_stream(self.device)
+                pitch_stream.wait_stream(current_stream)
+                embed_stream.wait_stream(current_stream)
 
             # embedding
-            feats = self.extractFeatures(feats, embOutputLayer, useFinalProj)
+            with _streamContext(embed_stream):
+                feats = self.extractFeatures(feats, embOutputLayer, useFinalProj)
             t.record("extract-feats")
 
+            # pitch detection
+            with _streamContext(pitch_stream):
+                pitch, pitchf = self.extractPitch(audio_pad, if_f0, pitchf, f0_up_key, silence_front)
+            t.record("extract-pitch")
+
+            if pitch_stream is not None and embed_stream is not None:
+                current_stream.wait_stream(pitch_stream)
+                current_stream.wait_stream(embed_stream)
+                feats.record_stream(current_stream)
+                if pitch is not None and pitchf is not None:
+                    pitch.record_stream(current_stream)
+                    pitchf.record_stream(current_stream)
+            self.checkFeatures(feats)
+            # numpy has no bfloat16; the index search, the onnx inferencer and the feature buffer all read feats through numpy.
+            if feats.dtype == torch.bfloat16:
+                feats = feats.float()
+
             # Index - feature extraction
             # if self.index is not None and self.feature is not None and index_rate != 0:
             if search_index:
@@ -206,7 +323,7 @@ class Pipeline(object):
                     npy = np.sum(self.big_npy[ix] * np.expand_dims(weight, axis=2), axis=1)
 
                 # recover silient font
-                npy = np.concatenate([np.zeros([npyOffset, npy.shape[1]], dtype=np.float32), feature[:npyOffset:2].astype("float32"), npy])[-feats.shape[1]:]
+                npy = np.concatenate([np.zeros([npyOffset, npy.shape[1]], dtype=np.float32), feature[:npyOffset:2].astype(np.float32, copy=False), npy])[-feats.shape[1]:]
                 feats = torch.from_numpy(npy).unsqueeze(0).to(self.device) * index_rate + (1 - index_rate) * feats
             feats = F.interpolate(feats.permute(0, 2, 1), scale_factor=2).permute(0, 2, 1)
             if protect < 0.5 and search_index:
@@ -277,6 +394,7 @@ class Pipeline(object):
         return audio1, pitchf_buffer, feats_buffer
 
     def __del__(self):
+        self.embedderGraphs.clear()
         del self.embedder
         del self.inferencer
         del self.pitchExtractor
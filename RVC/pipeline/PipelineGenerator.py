@@ -1,6 +1,10 @@
 import os
 import traceback
 import faiss
+import torch
+import torch._dynamo
+from torch._dynamo.utils import counters
+from mods.log_control import VoiceChangaerLogger
 from utils.Exceptions import PipelineCreateException
 from utils.ModelSlot import RVCModelSlot
 
@@ -11,10 +15,13 @@ from RVC.pipeline.Pipeline import Pipeline
 from RVC.pitchExtractor.PitchExtractorManager import PitchExtractorManager
 from utils.VoiceChangerParams import VoiceChangerParams
 
+logger = VoiceChangaerLogger.get_instance().getLogger()
+
 
 def createPipeline(params: VoiceChangerParams, modelSlot: RVCModelSlot, gpu: int, f0Detector: str):
     dev = DeviceManager.get_instance().getDevice(gpu)
     half = DeviceManager.get_instance().halfPrecisionAvailable(gpu)
+    halfDtype = DeviceManager.get_instance().halfPrecisionDtype(gpu) if half else None
 
     # Inferencer generation
     try:
@@ -32,12 +39,16 @@ def createPipeline(params: VoiceChangerParams, modelSlot: RVCModelSlot, gpu: int
             # emmbedderFilename,
             half,
             dev,
+            halfDtype if halfDtype is not None else torch.float16,
         )
     except Exception as e:
         print("[Voice Changer] exception! loading embedder", e, dev)
         traceback.print_exc()
         raise PipelineCreateException("[Voice Changer] exception! loading embedder")
 
+    # On cuda the embedder is replayed from CUDA graphs by the pipeline instead.
+    compiled = dev.type == "cpu" and _compileEmbedder(embedder)
+
     # pitchExtractor
     pitchExtractor = PitchExtractorManager.getPitchExtractor(f0Detector, gpu)
 
@@ -53,8 +64,15 @@ def createPipeline(params: VoiceChangerParams, modelSlot: RVCModelSlot, gpu: int
         modelSlot.samplingRate,
         dev,
         half,
+        halfDtype,
+        compiled,
     )
 
+    # big_npy has already been reconstructed from the cpu index, only the search is moved to the gpu.
+    if index is not None and dev.type == "cuda":
+        gpuIndex, indexResources = _indexToGpu(index, gpu)
+        pipeline.setIndex(gpuIndex, indexResources)
+
     return pipeline
 
 
@@ -75,3 +93,57 @@ def _loadIndex(indexPath: str):
         return None
 
     return index
+
+
+def _compileEmbedder(embedder):
+    model = getattr(embedder, "model", None)
+    if isinstance(model, torch.nn.Module) is False or hasattr(torch, "compile") is False:
+        return False
+
+    # The input shape only changes with the convert size, so the graph is specialized (dynamic=False).
+    # Dynamo keeps one graph for each shape it has seen, RVCr2 warms up the shape of the current settings.
+    eager = model.extract_features
+    try:
+        compiled = torch.compile(eager, dynamic=False)
+    except Exception as e:
+        print("[Voice Changer] torch.compile is not available. Use eager embedder.", e)
+        return False
+
+    def extract_features(*args, **kwargs):
+        nonlocal compiled
+        if compiled is not None:
+            graphs = counters["stats"]["unique_graphs"]
+            try:
+                result = compiled(*args, **kwargs)
+            except torch._dynamo.exc.TorchDynamoException as e:
+                # Only compiler failures fall back for good, errors of the embedder itself are raised as usual.
+                logger.warn(f"[Voice Changer] compiled embedder failed. Use eager embedder. {e}")
+                compiled = None
+            else:
+                # A new graph is only counted when dynamo actually compiled one for this call.
+                if counters["stats"]["unique_graphs"] != graphs:
+                    source = kwargs.get("source")
+                    logger.info(f"[Voice Changer] compiled embedder for input shape {tuple(source.shape) if source is not None else None}")
+                return result
+        return eager(*args, **kwargs)
+
+    model.extract_features = extract_features
+    return True
+
+
+def _indexToGpu(index, gpu: int):
+    # faiss-cpu builds have no gpu support, keep the cpu index then.
+    if hasattr(faiss, "StandardGpuResources") is False or faiss.get_num_gpus() == 0:
+        return index, None
+
+    try:
+        print("[Voice Changer] Moving index to gpu...", gpu)
+        # The resources must outlive the gpu index, so they are kept by the pipeline.
+        res = faiss.StandardGpuResources()
+        gpuIndex = faiss.index_cpu_to_gpu(res, gpu, index)
+    except:  # NOQA
+        print("[Voice Changer] move index to gpu failed. Use cpu index.")
+        traceback.print_exc()
+        return index, None
+
+    return gpuIndex, res
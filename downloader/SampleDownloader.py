@@ -43,11 +43,13 @@ def getSampleInfos(mode: RVCSampleMode):
 
 
 def _downloadSampleJsons(sampleJsonUrls: list[str]):
-    sampleJsons = []
-    for url in sampleJsonUrls:
-        filename = os.path.basename(url)
-        download_no_tqdm({"url": url, "saveTo": filename, "position": 0})
-        sampleJsons.append(filename)
+    sampleJsons = _generateSampleJsons(sampleJsonUrls)
+    downloadParams = [
+        {"url": url, "saveTo": filename, "position": 0}
+        for url, filename in zip(sampleJsonUrls, sampleJsons)
+    ]
+    with ThreadPoolExecutor(max_workers=max(len(downloadParams), 1)) as pool:
+        pool.map(download_no_tqdm, downloadParams)
     return sampleJsons
 
 
@@ -59,11 +61,18 @@ def _generateSampleJsons(sampleJsonUrls: list[str]):
     return sampleJsons
 
 
+def _loadJson(file: str):
+    with open(file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
 def _generateSampleList(sampleJsons: list[str]):
+    # Catalog files are read in parallel; map keeps them in the given order.
+    with ThreadPoolExecutor() as pool:
+        jsonDicts = list(pool.map(_loadJson, sampleJsons))
+
     samples: list[ModelSamples] = []
-    for file in sampleJsons:
-        with open(file, "r", encoding="utf-8") as f:
-            jsonDict = json.load(f)
+    for jsonDict in jsonDicts:
         for vcType in jsonDict:
             for sampleParams in jsonDict[vcType]:
                 sample = generateModelSample(sampleParams)
@@ -98,10 +107,8 @@ def _downloadSamples(samples: list[ModelSamples], sampleModelIds: list[Tuple[str
             slotInfo: RVCModelSlot = RVCModelSlot()
 
             os.makedirs(slotDir, exist_ok=True)
-            modelFilePath = os.path.join(
-                slotDir,
-                os.path.basename(sample.modelUrl),
-            )
+            modelFileName = os.path.basename(sample.modelUrl)
+            modelFilePath = os.path.join(slotDir, modelFileName)
             downloadParams.append(
                 {
                     "url": sample.modelUrl,
@@ -109,14 +116,12 @@ def _downloadSamples(samples: list[ModelSamples], sampleModelIds: list[Tuple[str
                     "position": line_num,
                 }
             )
-            slotInfo.modelFile = os.path.basename(sample.modelUrl)
+            slotInfo.modelFile = modelFileName
             line_num += 1
 
             if targetSampleParams["useIndex"] is True and hasattr(sample, "indexUrl") and sample.indexUrl != "":
-                indexPath = os.path.join(
-                    slotDir,
-                    os.path.basename(sample.indexUrl),
-                )
+                indexFileName = os.path.basename(sample.indexUrl)
+                indexPath = os.path.join(slotDir, indexFileName)
                 downloadParams.append(
                     {
                         "url": sample.indexUrl,
@@ -124,14 +129,12 @@ def _downloadSamples(samples: list[ModelSamples], sampleModelIds: list[Tuple[str
                         "position": line_num,
                     }
                 )
-                slotInfo.indexFile = os.path.basename(sample.indexUrl)
+                slotInfo.indexFile = indexFileName
                 line_num += 1
 
             if hasattr(sample, "icon") and sample.icon != "":
-                iconPath = os.path.join(
-                    slotDir,
-                    os.path.basename(sample.icon),
-                )
+                iconFileName = os.path.basename(sample.icon)
+                iconPath = os.path.join(slotDir, iconFileName)
                 downloadParams.append(
                     {
                         "url": sample.icon,
@@ -139,7 +142,7 @@ def _downloadSamples(samples: list[ModelSamples], sampleModelIds: list[Tuple[str
                         "position": line_num,
                     }
                 )
-                slotInfo.iconFile = os.path.basename(sample.icon)
+                slotInfo.iconFile = iconFileName
                 line_num += 1
 
             slotInfo.sampleId = sample.id
@@ -158,10 +161,8 @@ def _downloadSamples(samples: list[ModelSamples], sampleModelIds: list[Tuple[str
             slotInfo: DiffusionSVCModelSlot = DiffusionSVCModelSlot()
 
             os.makedirs(slotDir, exist_ok=True)
-            modelFilePath = os.path.join(
-                slotDir,
-                os.path.basename(sample.modelUrl),
-            )
+            modelFileName = os.path.basename(sample.modelUrl)
+            modelFilePath = os.path.join(slotDir, modelFileName)
             downloadParams.append(
                 {
                     "url": sample.modelUrl,
@@ -169,14 +170,12 @@ def _downloadSamples(samples: list[ModelSamples], sampleModelIds: list[Tuple[str
                     "position": line_num,
                 }
             )
-            slotInfo.modelFile = os.path.basename(sample.modelUrl)
+            slotInfo.modelFile = modelFileName
             line_num += 1
 
             if hasattr(sample, "icon") and sample.icon != "":
-                iconPath = os.path.join(
-                    slotDir,
-                    os.path.basename(sample.icon),
-                )
+                iconFileName = os.path.basename(sample.icon)
+                iconPath = os.path.join(slotDir, iconFileName)
                 downloadParams.append(
                     {
                         "url": sample.icon,
@@ -184,7 +183,7 @@ def _downloadSamples(samples: list[ModelSamples], sampleModelIds: list[Tuple[str
                         "position": line_num,
                     }
                 )
-                slotInfo.iconFile = os.path.basename(sample.icon)
+                slotInfo.iconFile = iconFileName
                 line_num += 1
 
             slotInfo.sampleId = sample.id
@@ -11,6 +11,17 @@ class NullHandler(logging.Handler):
         pass
 
 
+_SUPPRESS = UvicornSuppressFilter()
+_SUPPRESSED_LOGGERS = (
+    "fairseq.tasks.hubert_pretraining",
+    "fairseq.models.hubert.hubert",
+    "fairseq.tasks.text_to_speech",
+    "numba.core.ssa",
+    "numba.core.interpreter",
+    "numba.core.byteflow",
+)
+
+
 class VoiceChangaerLogger:
     _instance = None
 
@@ -28,23 +39,8 @@ class VoiceChangaerLogger:
         # logging.basicConfig(level=logging.NOTSET)
         logging.root.handlers = [NullHandler()]
 
-        logger = logging.getLogger("fairseq.tasks.hubert_pretraining")
-        logger.addFilter(UvicornSuppressFilter())
-
-        logger = logging.getLogger("fairseq.models.hubert.hubert")
-        logger.addFilter(UvicornSuppressFilter())
-
-        logger = logging.getLogger("fairseq.tasks.text_to_speech")
-        logger.addFilter(UvicornSuppressFilter())
-
-        logger = logging.getLogger("numba.core.ssa")
-        logger.addFilter(UvicornSuppressFilter())
-
-        logger = logging.getLogger("numba.core.interpreter")
-        logger.addFilter(UvicornSuppressFilter())
-
-        logger = logging.getLogger("numba.core.byteflow")
-        logger.addFilter(UvicornSuppressFilter())
+        for name in _SUPPRESSED_LOGGERS:
+            logging.getLogger(name).addFilter(_SUPPRESS)
 
         # logger.propagate = False
 
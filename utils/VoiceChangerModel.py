@@ -5,8 +5,8 @@ from utils.LoadModelParams import LoadModelParams
 
 
 AudioInOut: TypeAlias = np.ndarray[Any, np.dtype[np.int16]]
-PitchfInOut: TypeAlias = np.ndarray[Any, np.dtype[np.int16]]
-FeatureInOut: TypeAlias = np.ndarray[Any, np.dtype[np.int16]]
+PitchfInOut: TypeAlias = np.ndarray[Any, np.dtype[np.float32]]
+FeatureInOut: TypeAlias = np.ndarray[Any, np.dtype[np.float32]]
 
 
 class VoiceChangerModel(Protocol):